@@ -0,0 +1,263 @@
+# backend / export.py
+
+import csv
+import io
+import json
+import math
+import zlib
+from datetime import date
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import models
+import recurring
+from database import SessionLocal
+
+# Rows fetched per round trip while streaming, and rows per snapshot block
+EXPORT_BATCH_SIZE = 1000
+
+# Columns written to CSV / NDJSON exports (compatible with the /upload/ CSV format)
+EXPORT_COLUMNS = ["transaction_id", "date", "merchant_name", "amount", "category"]
+
+SNAPSHOT_FORMAT = "budgetwise-snapshot"
+SNAPSHOT_VERSION = 1
+
+# Dates in snapshots are stored as day offsets from this epoch
+SNAPSHOT_EPOCH = date(1970, 1, 1).toordinal()
+SNAPSHOT_MAX_ORDINAL = date.max.toordinal()
+
+# Snapshot imports are decompressed this many bytes at a time, and refused
+# once the uncompressed data passes MAX_SNAPSHOT_SIZE (guards against gzip bombs)
+SNAPSHOT_READ_SIZE = 64 * 1024
+MAX_SNAPSHOT_SIZE = 256 * 1024 * 1024
+
+
+# --- READING ---
+
+def _build_query(db: Session, start_date=None, end_date=None, category=None):
+    query = db.query(
+        models.Transaction.transaction_id,
+        models.Transaction.date,
+        models.Transaction.merchant_name,
+        models.Transaction.amount,
+        models.Transaction.category,
+    )
+    if start_date:
+        query = query.filter(models.Transaction.date >= start_date)
+    if end_date:
+        query = query.filter(models.Transaction.date <= end_date)
+    if category:
+        query = query.filter(models.Transaction.category == category)
+    return query.order_by(models.Transaction.date, models.Transaction.id)
+
+def iter_rows(start_date=None, end_date=None, category=None):
+    '''
+    Yield matching transactions as tuples in EXPORT_COLUMNS order.
+
+    Uses its own session, since a StreamingResponse keeps reading after the
+    request's dependencies may have been closed, and fetches through a
+    server-side cursor EXPORT_BATCH_SIZE rows at a time.
+    '''
+    with SessionLocal() as db:
+        query = _build_query(db, start_date, end_date, category).yield_per(EXPORT_BATCH_SIZE)
+        for row in query:
+            yield tuple(row)
+
+def _batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- CSV / NDJSON ---
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _batched(rows):
+        for transaction_id, txn_date, merchant_name, amount, category in batch:
+            writer.writerow([transaction_id, txn_date.isoformat(), merchant_name, amount, category])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    # Header only, when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def stream_ndjson(rows):
+    for batch in _batched(rows):
+        lines = [
+            json.dumps(dict(zip(EXPORT_COLUMNS, (transaction_id, txn_date.isoformat(), merchant_name, amount, category))))
+            for transaction_id, txn_date, merchant_name, amount, category in batch
+        ]
+        yield "\n".join(lines) + "\n"
+
+
+# --- SNAPSHOT ---
+# A snapshot is a gzip stream of JSON lines: one header line, then one line per
+# block of up to EXPORT_BATCH_SIZE rows. Each block is stored column by column,
+# with dates as day offsets and merchant/category names dictionary-encoded, so
+# it compresses well and can be inserted without merchant lookups or LLM calls.
+
+def _encode_block(batch):
+    merchants, categories = {}, {}
+    columns = {"transaction_id": [], "date": [], "merchant": [], "amount": [], "category": []}
+    for transaction_id, txn_date, merchant_name, amount, category in batch:
+        columns["transaction_id"].append(transaction_id)
+        columns["date"].append(txn_date.toordinal() - SNAPSHOT_EPOCH)
+        columns["merchant"].append(merchants.setdefault(merchant_name, len(merchants)))
+        columns["amount"].append(amount)
+        columns["category"].append(categories.setdefault(category, len(categories)))
+    return {
+        "rows": len(batch),
+        "merchants": list(merchants),
+        "categories": list(categories),
+        "columns": columns,
+    }
+
+def stream_snapshot(rows):
+    compressor = zlib.compressobj(level=9, wbits=31) # wbits=31 writes a gzip container
+    header = {"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "columns": EXPORT_COLUMNS}
+    yield compressor.compress((json.dumps(header) + "\n").encode("utf-8"))
+    for batch in _batched(rows):
+        line = json.dumps(_encode_block(batch), separators=(",", ":")) + "\n"
+        chunk = compressor.compress(line.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _is_index(value, size):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < size
+
+def _decode_block(block):
+    '''
+    Turn one columnar block back into row dicts, checking every value.
+    Raises ValueError on anything a valid snapshot could not contain.
+    '''
+    if not isinstance(block, dict):
+        raise ValueError("block is not an object")
+    columns = block.get("columns")
+    merchants = block.get("merchants")
+    categories = block.get("categories")
+    if not isinstance(columns, dict) or not isinstance(merchants, list) or not isinstance(categories, list):
+        raise ValueError("block is missing columns, merchants or categories")
+    if not all(isinstance(name, str) for name in merchants + categories):
+        raise ValueError("merchant and category names must be strings")
+
+    names = ["transaction_id", "date", "merchant", "amount", "category"]
+    values = [columns.get(name) for name in names]
+    if not all(isinstance(v, list) for v in values) or len({len(v) for v in values}) != 1:
+        raise ValueError("columns must be lists of equal length")
+
+    rows = []
+    for i, (transaction_id, day, merchant, amount, category) in enumerate(zip(*values)):
+        # Empty IDs are allowed: /upload/ accepts them, so snapshots can contain them
+        if not isinstance(transaction_id, str):
+            raise ValueError(f"row {i}: invalid transaction_id")
+        if not isinstance(day, int) or isinstance(day, bool) or not 1 <= day + SNAPSHOT_EPOCH <= SNAPSHOT_MAX_ORDINAL:
+            raise ValueError(f"row {i}: invalid date")
+        if not _is_index(merchant, len(merchants)):
+            raise ValueError(f"row {i}: invalid merchant index")
+        if not _is_number(amount):
+            raise ValueError(f"row {i}: invalid amount")
+        if not _is_index(category, len(categories)):
+            raise ValueError(f"row {i}: invalid category index")
+        rows.append({
+            "transaction_id": transaction_id,
+            "date": date.fromordinal(day + SNAPSHOT_EPOCH),
+            "merchant_name": merchants[merchant],
+            "amount": float(amount),
+            "category": categories[category],
+        })
+    return rows
+
+def _iter_snapshot_lines(fileobj):
+    '''
+    Decompress a snapshot a chunk at a time and yield its lines, so only one
+    block is held in memory. Stops with ValueError past MAX_SNAPSHOT_SIZE.
+    '''
+    decompressor = zlib.decompressobj(wbits=31)
+    total_size = 0
+    pending = b""
+    try:
+        while not decompressor.eof:
+            data = fileobj.read(SNAPSHOT_READ_SIZE)
+            if not data:
+                raise ValueError("Snapshot is truncated.")
+            while data and not decompressor.eof:
+                out = decompressor.decompress(data, SNAPSHOT_READ_SIZE)
+                data = decompressor.unconsumed_tail
+                total_size += len(out)
+                if total_size > MAX_SNAPSHOT_SIZE:
+                    raise ValueError(f"Snapshot is larger than {MAX_SNAPSHOT_SIZE // (1024 * 1024)} MB uncompressed.")
+                parts = out.split(b"\n")
+                if len(parts) > 1:
+                    yield pending + parts[0]
+                    yield from parts[1:-1]
+                    pending = parts[-1]
+                else:
+                    pending += out
+    except zlib.error as e:
+        raise ValueError(f"Could not read snapshot: {e}")
+    if pending:
+        yield pending
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Could not read snapshot: {e}")
+
+def load_snapshot(db: Session, fileobj):
+    '''
+    Bulk insert a snapshot read from a binary file object, skipping transaction
+    IDs that already exist. Raises ValueError if the file is not a valid
+    snapshot. The caller commits.
+    '''
+    lines = (line for line in _iter_snapshot_lines(fileobj) if line.strip())
+    header = _parse_line(next(lines, b"{}"))
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot format or version.")
+
+    imported_count = 0
+    skipped_count = 0
+    # One recurring batch for the whole file, so each group is loaded and re-evaluated once
+    recurring_batch = recurring.start_batch()
+    for block_number, line in enumerate(lines, start=1):
+        try:
+            rows = _decode_block(_parse_line(line))
+        except ValueError as e:
+            raise ValueError(f"Corrupt snapshot block {block_number}: {e}")
+
+        # One lookup per block instead of one per row
+        block_ids = [r["transaction_id"] for r in rows]
+        existing_ids = {
+            tid for (tid,) in db.query(models.Transaction.transaction_id).filter(
+                models.Transaction.transaction_id.in_(block_ids)
+            )
+        }
+        new_rows = []
+        for r in rows:
+            if r["transaction_id"] in existing_ids:
+                skipped_count += 1
+                continue
+            existing_ids.add(r["transaction_id"]) # Guards against repeats within the file
+            new_rows.append(r)
+
+        if new_rows:
+            inserted = db.scalars(insert(models.Transaction).returning(models.Transaction), new_rows).all()
+            recurring.add_to_batch(db, recurring_batch, inserted)
+            imported_count += len(inserted)
+
+    recurring.finish_batch(recurring_batch)
+    return imported_count, skipped_count
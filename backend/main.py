@@ -5,12 +5,14 @@ import io
 import json
 import uuid
 import os
+import re
 from datetime import datetime, date, timedelta
 from typing import List, Optional
 from dotenv import load_dotenv
 import calendar
 
 from fastapi import FastAPI, Depends, File, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, exists
 from pydantic import ValidationError
@@ -18,6 +20,8 @@ from pydantic import ValidationError
 # Created Components
 import models
 import schemas
+import recurring
+import export
 from database import SessionLocal, engine
 
 # Allow CORS for local development
@@ -35,6 +39,11 @@ models.Base.metadata.create_all(bind=engine)
 
 print("All tables created:", models.Base.metadata.tables.keys())
 
+# Seed recurring payments for transactions imported before detection existed,
+# so uploads only ever need to touch the groups of their own rows
+with SessionLocal() as seed_db:
+    recurring.ensure_seeded(seed_db)
+
 # Initialise FastAPI app
 app = FastAPI()
 
@@ -110,6 +119,7 @@ def update_transaction_category(
     
     # Update category and commit change
     db_transaction.category = transaction_update.category
+    recurring.update_category(db, db_transaction)
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
@@ -143,7 +153,29 @@ async def chat_with_ai(chat_request: schemas.ChatRequest, db: Session = Depends(
         
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing SQL query: {str(e)}")
-        
+
+    # Recurring payments come straight from the recurring_payments table
+    elif "subscription" in question or "recurring" in question:
+        try:
+            payments = recurring.get_recurring(db)
+
+            if payments:
+                lines = [
+                    f"- {p.merchant_name}: £{p.average_amount:.2f} {p.cadence}, next expected {p.next_expected_date}"
+                    for p in payments
+                ]
+                total_monthly = sum(recurring.monthly_cost(p) for p in payments)
+                response_text = (
+                    f"I found {len(payments)} recurring payments, costing about £{total_monthly:.2f} a month:\n"
+                    + "\n".join(lines)
+                )
+            else:
+                response_text = "I couldn't find any recurring payments in your transactions."
+
+            return {"response": response_text}
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error looking up recurring payments: {str(e)}")
 
     # 2: LLM Fallback for conversational questions
     else:
@@ -156,6 +188,11 @@ async def chat_with_ai(chat_request: schemas.ChatRequest, db: Session = Depends(
             [f"- Date: {t.date}, Merchant: {t.merchant_name}, Amount: £{t.amount}, Category: {t.category}" for t in recent_transactions]
         )
 
+        # Recurring payments cover the full history, not just the recent rows above
+        recurring_list_str = "\n".join(
+            [f"- Merchant: {p.merchant_name}, Amount: £{p.average_amount}, Cadence: {p.cadence}, Last paid: {p.last_date}" for p in recurring.get_recurring(db)]
+        ) or "None detected"
+
         # Construct prompt
         prompt = f"""
         You are a friendly and helpful financial assistant called Felix.
@@ -165,6 +202,9 @@ async def chat_with_ai(chat_request: schemas.ChatRequest, db: Session = Depends(
         Here are the user's recent transactions:
         {transaction_list_str}
 
+        Here are the user's detected recurring payments and subscriptions:
+        {recurring_list_str}
+
         User's question: "{chat_request.question}"
         """
 
@@ -185,6 +225,45 @@ def get_transactions(db: Session = Depends(get_db)):
     transactions = db.query(models.Transaction).order_by(models.Transaction.date.desc()).all()
     return transactions
 
+@app.get("/recurring/", response_model=List[schemas.RecurringPayment])
+def get_recurring_payments(
+    cadence: Optional[str] = None, # weekly / monthly / annual
+    include_lapsed: bool = False, # Also return payments that have stopped
+    db: Session = Depends(get_db)
+):
+    '''
+    Retrieve detected recurring payments and subscriptions, most recently paid first.
+    '''
+    if cadence and cadence not in recurring.CADENCES:
+        raise HTTPException(status_code=400, detail=f"Invalid cadence. Use one of: {', '.join(recurring.CADENCES)}.")
+
+    payments = recurring.get_recurring(db, cadence, include_lapsed)
+    as_of = recurring.latest_activity_date(db)
+    return [
+        {
+            "id": p.id, "merchant_name": p.merchant_name, "category": p.category, "cadence": p.cadence,
+            "average_amount": p.average_amount, "monthly_cost": round(recurring.monthly_cost(p), 2),
+            "occurrence_count": p.occurrence_count, "first_date": p.first_date, "last_date": p.last_date,
+            "next_expected_date": p.next_expected_date, "active": recurring.is_active(p, as_of),
+        }
+        for p in payments
+    ]
+
+@app.post("/recurring/rebuild/")
+def rebuild_recurring_payments(db: Session = Depends(get_db)):
+    '''
+    Recompute every recurring group from scratch (e.g. after tuning detection settings).
+    '''
+    try:
+        recurring.rebuild(db)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR rebuilding recurring payments: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild recurring payments: {e}")
+
+    detected_count = len(recurring.get_recurring(db))
+    return {"message": "Recurring payments rebuilt.", "detected_count": detected_count}
+
 @app.post("/upload/")
 async def upload_csv(
     file: UploadFile = File(...), db: Session = Depends(get_db)
@@ -336,6 +415,8 @@ async def upload_csv(
     if valid_transactions:
         try:
             db.add_all(valid_transactions)
+            db.flush() # Assign IDs so recurring groups can reference them
+            recurring.record_transactions(db, valid_transactions)
             db.commit()
             print("Transactions committed to database.")
         except Exception as e:
@@ -364,6 +445,90 @@ async def upload_csv(
         "skipped_rows": skipped_rows,
     }
 
+# Content type and file extension for each export format
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+def _export_filename(extension, start_date, end_date, category):
+    parts = ["budgetwise"]
+    if start_date: parts.append(f"from-{start_date.isoformat()}")
+    if end_date: parts.append(f"to-{end_date.isoformat()}")
+    # Keep the header latin-1 safe and unquotable: only [a-z0-9-] from the category
+    category_slug = re.sub(r"[^a-z0-9]+", "-", (category or "").lower()).strip("-")
+    if category_slug: parts.append(category_slug)
+    return f"{'_'.join(parts)}.{extension}"
+
+@app.get("/export/")
+def export_transactions(
+    format: str = "csv", # csv or ndjson
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    category: Optional[str] = None,
+):
+    '''
+    Stream transactions as CSV or newline-delimited JSON, oldest first.
+    Rows are read in batches, so memory use does not grow with the table.
+    '''
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date.")
+
+    media_type, extension = EXPORT_FORMATS[format]
+    rows = export.iter_rows(start_date, end_date, category)
+    stream = export.stream_csv(rows) if format == "csv" else export.stream_ndjson(rows)
+    filename = _export_filename(extension, start_date, end_date, category)
+    return StreamingResponse(stream, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/export/snapshot/")
+def export_snapshot(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    category: Optional[str] = None,
+):
+    '''
+    Stream a compressed columnar snapshot that can be restored with POST /import/snapshot/.
+    '''
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date.")
+
+    rows = export.iter_rows(start_date, end_date, category)
+    filename = _export_filename("snapshot.gz", start_date, end_date, category)
+    return StreamingResponse(
+        export.stream_snapshot(rows),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.post("/import/snapshot/")
+def import_snapshot(
+    file: UploadFile = File(...), db: Session = Depends(get_db)
+):
+    '''
+    Bulk restore transactions from a snapshot. Categories are kept as exported,
+    so no merchant lookups or LLM calls are made. Existing transaction IDs are skipped.
+    '''
+    try:
+        # Read from the spooled upload file so the snapshot is decompressed incrementally
+        imported_count, skipped_count = export.load_snapshot(db, file.file)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR importing snapshot: {e}")
+        raise HTTPException(status_code=500, detail=f"Snapshot import failed: {e}")
+
+    print(f"Snapshot imported: {imported_count} new, {skipped_count} skipped.")
+    return {
+        "message": "Snapshot imported.",
+        "imported_count": imported_count,
+        "skipped_count": skipped_count,
+    }
+
 # POST endpoint to set monthly budget
 @app.post("/budget/", status_code=200)
 def set_budget(budget_update: schemas.BudgetUpdate, db: Session = Depends(get_db)):
@@ -562,6 +727,8 @@ def create_transaction(
 
     try:
         db.add(db_transaction)
+        db.flush()
+        recurring.record_transactions(db, [db_transaction])
         db.commit()
         db.refresh(db_transaction) # Refresh to get DB-generated ID etc.
         print("Manual transaction committed successfully.")
@@ -589,6 +756,7 @@ def delete_transaction(
 
     # Delete the transaction
     try:
+        recurring.forget_transaction(db, db_transaction)
         db.delete(db_transaction)
         db.commit()
         print(f"Transaction ID {transaction_id} deleted successfully.")
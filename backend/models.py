@@ -1,6 +1,6 @@
 # backend / models.py
 
-from sqlalchemy import Column, Integer, String, Float, Date
+from sqlalchemy import Column, Integer, String, Float, Date, Text
 from database import Base
 
 class Transaction(Base):
@@ -17,4 +17,20 @@ class UserSettings(Base):
     __tablename__ = "user_settings"
 
     id = Column(Integer, primary_key=True)
-    monthly_budget = Column(Float, nullable = True)
\ No newline at end of file
+    monthly_budget = Column(Float, nullable = True)
+
+class RecurringPayment(Base):
+    __tablename__ = "recurring_payments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_key = Column(String, index=True, nullable=False) # Normalised merchant name, shared by its amount clusters
+    merchant_name = Column(String, nullable=False) # Most recently seen display name
+    category = Column(String, default = "Uncategorized", nullable=False)
+    cadence = Column(String, nullable=True) # weekly / monthly / annual, None if no pattern yet
+    average_amount = Column(Float, nullable=False, default=0.0)
+    median_amount = Column(Float, nullable=False, default=0.0) # Centre of the amount cluster
+    occurrence_count = Column(Integer, nullable=False, default=0)
+    first_date = Column(Date, nullable=True)
+    last_date = Column(Date, nullable=True)
+    next_expected_date = Column(Date, nullable=True)
+    occurrences = Column(Text, nullable=False, default="[]") # JSON list of [id, date, amount]
@@ -0,0 +1,330 @@
+# backend / recurring.py
+
+import calendar
+import json
+import math
+import re
+import statistics
+from datetime import date, timedelta
+
+from sqlalchemy import exists, func
+from sqlalchemy.orm import Session
+
+import models
+
+# Each cadence is (period in days, tolerance in days, minimum occurrences).
+# Monthly and annual periods are calendar averages so long schedules don't drift.
+CADENCES = {
+    "weekly": (7, 2, 3),
+    "monthly": (30.44, 5, 3),
+    "annual": (365.25, 15, 3),
+}
+
+# A payment is "on schedule" if it lands within the tolerance of a slot of the
+# expected schedule. At least this share of the payments, and of the slots
+# between the first and last payment, must be on schedule, so one late or one
+# skipped payment in every four is let through.
+CADENCE_MATCH_RATIO = 0.75
+
+# Most payment dates tried as the anchor of the expected schedule
+MAX_SCHEDULE_ANCHORS = 12
+
+# Payments from the same merchant join a cluster if they are within this share
+# (or AMOUNT_TOLERANCE_MIN, for small amounts) of the cluster's median amount
+AMOUNT_TOLERANCE = 0.15
+AMOUNT_TOLERANCE_MIN = 0.5
+
+# Tokens that carry no information about who the merchant is
+MERCHANT_NOISE_TOKENS = {"ltd", "limited", "plc", "inc", "com", "co", "uk", "www", "payment", "card", "dd"}
+
+# Batch size when streaming the transactions table for a full rebuild
+REBUILD_BATCH_SIZE = 500
+
+
+# --- GROUPING ---
+
+def normalize_merchant(merchant_name):
+    '''
+    Reduce a merchant name to a stable key, e.g. "NETFLIX.COM 8842" -> "netflix".
+    '''
+    tokens = re.sub(r"[^a-z]+", " ", (merchant_name or "").lower()).split()
+    tokens = [t for t in tokens if t not in MERCHANT_NOISE_TOKENS]
+    return " ".join(tokens) or (merchant_name or "").strip().lower()
+
+def amount_matches(amount, median_amount):
+    return abs(amount - median_amount) <= max(median_amount * AMOUNT_TOLERANCE, AMOUNT_TOLERANCE_MIN)
+
+
+# --- CADENCE DETECTION ---
+
+def _add_months(start, months):
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+def next_expected_date(last_date, cadence):
+    if cadence == "weekly":
+        return last_date + timedelta(days=7)
+    if cadence == "monthly":
+        return _add_months(last_date, 1)
+    if cadence == "annual":
+        return _add_months(last_date, 12)
+    return None
+
+def _schedule_hits(dates, anchor, period, tolerance):
+    '''
+    Count the distinct schedule slots (anchor + n * period) that have a payment within tolerance.
+    '''
+    slots = set()
+    for d in dates:
+        offset = (d - anchor).days
+        slot = round(offset / period)
+        if abs(offset - slot * period) <= tolerance:
+            slots.add(slot)
+    return len(slots)
+
+def detect_cadence(dates):
+    '''
+    Return the cadence name that fits a list of payment dates, or None.
+    '''
+    unique_dates = sorted(set(dates))
+    if len(unique_dates) < 2:
+        return None
+
+    # Any payment may be the late one, so try several as the schedule anchor
+    step = max(1, len(unique_dates) // MAX_SCHEDULE_ANCHORS)
+    anchors = unique_dates[::step]
+    span_days = (unique_dates[-1] - unique_dates[0]).days
+
+    for cadence, (period, tolerance, min_occurrences) in CADENCES.items():
+        if len(unique_dates) < min_occurrences:
+            continue
+        expected_slots = round(span_days / period) + 1
+        hits = max(_schedule_hits(unique_dates, anchor, period, tolerance) for anchor in anchors)
+        if (
+            hits >= min_occurrences
+            and hits >= len(unique_dates) * CADENCE_MATCH_RATIO
+            and hits >= expected_slots * CADENCE_MATCH_RATIO
+        ):
+            return cadence
+    return None
+
+
+# --- INCREMENTAL UPDATES ---
+
+def _refresh_group(group, occurrences):
+    '''
+    Recompute the summary columns of a group from its stored occurrences.
+    '''
+    occurrences.sort(key=lambda o: (o[1], o[0]))
+    group.occurrences = json.dumps(occurrences)
+    group.occurrence_count = len(occurrences)
+
+    if not occurrences:
+        group.cadence = None
+        group.average_amount = group.median_amount = 0.0
+        group.first_date = group.last_date = group.next_expected_date = None
+        return
+
+    dates = [date.fromisoformat(o[1]) for o in occurrences]
+    group.average_amount = round(sum(o[2] for o in occurrences) / len(occurrences), 2)
+    group.median_amount = statistics.median(o[2] for o in occurrences)
+    group.first_date = dates[0]
+    group.last_date = dates[-1]
+    group.cadence = detect_cadence(dates)
+    group.next_expected_date = next_expected_date(group.last_date, group.cadence)
+
+def start_batch(all_loaded=False):
+    '''
+    Create the state used to fold transactions into groups over one or more chunks.
+
+    groups: {merchant_key: [RecurringPayment]} for every merchant seen so far
+    touched: {RecurringPayment: [occurrences, occurrence ids, latest transaction]}
+    all_loaded: skip DB lookups because every group is already in memory (rebuild)
+    '''
+    return {"groups": {}, "touched": {}, "loaded_keys": set(), "all_loaded": all_loaded}
+
+def add_to_batch(db: Session, batch, transactions):
+    '''
+    Assign a chunk of transactions to groups without re-evaluating them.
+
+    Each transaction joins the group of the same merchant whose median amount
+    is closest within tolerance, or starts a new one. Medians are refreshed once
+    per chunk, and groups of merchants not seen before are loaded with one query.
+    '''
+    groups, touched = batch["groups"], batch["touched"]
+    new_keys = {normalize_merchant(t.merchant_name) for t in transactions} - batch["loaded_keys"]
+    if new_keys and not batch["all_loaded"]:
+        for g in db.query(models.RecurringPayment).filter(
+            models.RecurringPayment.merchant_key.in_(list(new_keys))
+        ):
+            groups.setdefault(g.merchant_key, []).append(g)
+    batch["loaded_keys"] |= new_keys
+
+    chunk_groups = set()
+    for t in sorted(transactions, key=lambda t: t.date):
+        key = normalize_merchant(t.merchant_name)
+        amount = abs(t.amount or 0)
+        candidates = groups.setdefault(key, [])
+
+        group, best_distance = None, None
+        for g in candidates:
+            distance = abs(amount - g.median_amount)
+            if amount_matches(amount, g.median_amount) and (best_distance is None or distance < best_distance):
+                group, best_distance = g, distance
+
+        if group is None:
+            group = models.RecurringPayment(merchant_key=key, median_amount=amount, occurrences="[]")
+            db.add(group)
+            candidates.append(group)
+
+        if group not in touched:
+            occurrences = json.loads(group.occurrences or "[]")
+            touched[group] = [occurrences, {o[0] for o in occurrences}, None]
+        occurrences, occurrence_ids, _ = touched[group]
+        if t.id not in occurrence_ids:
+            occurrence_ids.add(t.id)
+            occurrences.append([t.id, t.date.isoformat(), amount])
+        touched[group][2] = t
+        chunk_groups.add(group)
+
+    for group in chunk_groups:
+        group.median_amount = statistics.median(o[2] for o in touched[group][0])
+
+def finish_batch(batch):
+    '''
+    Re-evaluate every group the batch touched, once each. The caller commits.
+    '''
+    for group, (occurrences, _, latest) in batch["touched"].items():
+        if group.last_date is None or latest.date >= group.last_date:
+            group.merchant_name = latest.merchant_name
+            group.category = latest.category
+        _refresh_group(group, occurrences)
+    batch["touched"] = {}
+
+def record_transactions(db: Session, transactions):
+    '''
+    Fold new transactions into their recurring groups.
+
+    Only the groups of the merchants in this import are loaded and
+    re-evaluated, so the cost follows the size of the import rather than the
+    whole table. Transactions must already have a primary key (flush before
+    calling); the caller is responsible for committing.
+    '''
+    batch = start_batch()
+    add_to_batch(db, batch, transactions)
+    finish_batch(batch)
+
+def _find_group(db: Session, transaction):
+    '''
+    Return (group, occurrences) for the group holding a transaction, or (None, None).
+    '''
+    groups = db.query(models.RecurringPayment).filter(
+        models.RecurringPayment.merchant_key == normalize_merchant(transaction.merchant_name)
+    )
+    for group in groups:
+        occurrences = json.loads(group.occurrences or "[]")
+        if any(o[0] == transaction.id for o in occurrences):
+            return group, occurrences
+    return None, None
+
+def forget_transaction(db: Session, transaction):
+    '''
+    Remove a single transaction from its recurring group (e.g. on delete).
+    '''
+    group, occurrences = _find_group(db, transaction)
+    if group is None:
+        return
+
+    occurrences = [o for o in occurrences if o[0] != transaction.id]
+    if not occurrences:
+        db.delete(group)
+        return
+    _refresh_group(group, occurrences)
+
+def update_category(db: Session, transaction):
+    '''
+    Carry a transaction's new category over to its recurring group.
+    '''
+    group, _ = _find_group(db, transaction)
+    if group is not None:
+        group.category = transaction.category
+
+def rebuild(db: Session):
+    '''
+    Drop all groups and rebuild them from the transactions table.
+    Used once to seed the table for data that predates recurring detection.
+    '''
+    db.query(models.RecurringPayment).delete()
+    db.flush()
+
+    # Every group is built in memory and evaluated once at the end
+    batch = start_batch(all_loaded=True)
+    query = db.query(models.Transaction).order_by(models.Transaction.id).yield_per(REBUILD_BATCH_SIZE)
+    chunk = []
+    for t in query:
+        chunk.append(t)
+        if len(chunk) >= REBUILD_BATCH_SIZE:
+            add_to_batch(db, batch, chunk)
+            chunk = []
+    if chunk:
+        add_to_batch(db, batch, chunk)
+    finish_batch(batch)
+    db.commit()
+
+def ensure_seeded(db: Session):
+    '''
+    Rebuild once if transactions exist but no groups do (run at startup).
+    '''
+    has_groups = db.query(exists().where(models.RecurringPayment.id.isnot(None))).scalar()
+    if has_groups:
+        return
+    has_transactions = db.query(exists().where(models.Transaction.id.isnot(None))).scalar()
+    if has_transactions:
+        print("No recurring groups found, rebuilding from transactions...")
+        rebuild(db)
+
+
+# --- QUERIES ---
+
+def latest_activity_date(db: Session):
+    '''
+    Most recent payment date across all groups. Statements are uploaded after
+    the fact, so lapsing is measured from here rather than from today.
+    '''
+    return db.query(func.max(models.RecurringPayment.last_date)).scalar()
+
+def is_active(payment, as_of):
+    '''
+    A payment has lapsed once its next expected date is more than the cadence tolerance before as_of.
+    '''
+    if as_of is None:
+        return True
+    tolerance = CADENCES[payment.cadence][1]
+    return payment.next_expected_date + timedelta(days=math.ceil(tolerance)) >= as_of
+
+def get_recurring(db: Session, cadence=None, include_lapsed=False):
+    '''
+    Return the groups that have a detected cadence, most recent first.
+    Lapsed groups are left out unless include_lapsed is set.
+    '''
+    query = db.query(models.RecurringPayment).filter(models.RecurringPayment.cadence.isnot(None))
+    if cadence:
+        query = query.filter(models.RecurringPayment.cadence == cadence)
+    payments = query.order_by(models.RecurringPayment.last_date.desc()).all()
+    if include_lapsed:
+        return payments
+    as_of = latest_activity_date(db)
+    return [p for p in payments if is_active(p, as_of)]
+
+def monthly_cost(payment):
+    '''
+    Normalise a recurring payment to an approximate monthly cost.
+    '''
+    if payment.cadence == "weekly":
+        return payment.average_amount * 52 / 12
+    if payment.cadence == "annual":
+        return payment.average_amount / 12
+    return payment.average_amount
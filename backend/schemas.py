@@ -55,4 +55,21 @@ class TransactionManualCreate(BaseModel):
     merchant_name: str
     amount: float
     date: date
-    category: str # Category is required for manual entry
\ No newline at end of file
+    category: str # Category is required for manual entry
+
+# Schema for a detected recurring payment / subscription
+class RecurringPayment(BaseModel):
+    id: int
+    merchant_name: str
+    category: str
+    cadence: str
+    average_amount: float
+    monthly_cost: float
+    occurrence_count: int
+    first_date: date
+    last_date: date
+    next_expected_date: date
+    active: bool
+
+    class Config:
+        from_attributes = True